@@ -5,12 +5,22 @@ ComfyUI Workflow Manager Plugin
 """
 
 import os
+import copy
+import re
 import json
+import time
 import shutil
+import asyncio
 import logging
-from aiohttp import web
+import tempfile
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web, payload, MultipartWriter
 import folder_paths
 from server import PromptServer
+from .preview_pipeline import transcode_preview, discard_outputs, thumbnail_suffix
+from .workflow_revisions import RevisionStore, split_workflow, diff_lines
 
 WEB_DIRECTORY = "./js"
 NODE_CLASS_MAPPINGS = {}
@@ -20,14 +30,44 @@ __version__ = "1.0.0"
 __author__ = "ComfyUI Community"
 __description__ = "Complete workflow file manager with full filesystem operations"
 
-def get_workflows_directory():
+# 预览图格式（按查找优先级排列）
+PREVIEW_CONTENT_TYPES = {
+    '.webp': 'image/webp',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.bmp': 'image/bmp'
+}
+# 预生成的缩略图文件名格式，例如 xxx.thumb-256.webp
+THUMBNAIL_SUFFIX_PATTERN = re.compile(r'\.thumb-(\d+)\.webp')
+# 批量预览图请求的最大数量和默认分页大小
+PREVIEW_BATCH_MAX_ITEMS = 200
+PREVIEW_BATCH_DEFAULT_LIMIT = 50
+
+# 预览图响应头 - 禁用缓存
+PREVIEW_NO_CACHE_HEADERS = {
+    'Cache-Control': 'no-cache, no-store, must-revalidate',  # 禁用缓存
+    'Pragma': 'no-cache',  # HTTP/1.0兼容
+    'Expires': '0',  # 立即过期
+    'Access-Control-Allow-Origin': '*'
+}
+
+# 共享目录的虚拟路径前缀，例如 @shared/团队库/xxx.json
+SHARED_ROOT_PREFIX = '@shared'
+# 每个根目录的目录列表缓存上限（按缓存的条目总数计算）
+LISTING_CACHE_MAX_ITEMS = 20000
+# 修改时间距今小于该值（纳秒）的目录不缓存，避免文件系统时间精度不足导致漏检变化
+LISTING_CACHE_RACY_WINDOW_NS = 2_000_000_000
+
+def get_workflows_directory(user_id="default"):
     """获取用户工作流目录路径"""
     user_dir = folder_paths.get_user_directory()
-    return os.path.join(user_dir, "default", "workflows")
+    return os.path.join(user_dir, user_id, "workflows")
 
-def ensure_workflows_directory():
+def ensure_workflows_directory(user_id="default"):
     """确保工作流目录存在"""
-    workflows_dir = get_workflows_directory()
+    workflows_dir = get_workflows_directory(user_id)
     os.makedirs(workflows_dir, exist_ok=True)
     return workflows_dir
 
@@ -36,21 +76,37 @@ def get_config_path():
     plugin_dir = os.path.dirname(__file__)
     return os.path.join(plugin_dir, '.workflow_manager_config.json')
 
+# 配置文件缓存，以文件修改时间和大小校验，避免每次解析路径都重新读取
+_config_cache = {"key": None, "config": None}
+
 def load_config():
     """加载配置文件"""
     config_path = get_config_path()
     default_config = {
         'viewMode': 'list',  # 默认列表视图
         'sortBy': 'name',
-        'sortOrder': 'asc'
+        'sortOrder': 'asc',
+        'previewMaxSize': 1024,  # 预览图最大边长
+        'previewQuality': 85,  # WebP压缩质量
+        'previewThumbnailSizes': [128, 256],  # 预生成的缩略图尺寸
+        'previewMaxUploadMB': 32,  # 上传预览图大小上限
+        'previewWorkers': 2,  # 预览图处理线程数
+        'revisionsEnabled': False,  # 是否记录工作流修订历史
+        'revisionsMaxMB': 256  # 每个用户修订历史的大小预算
     }
     
     try:
         if os.path.exists(config_path):
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
+            stat = os.stat(config_path)
+            cache_key = (stat.st_mtime_ns, stat.st_size)
+            if _config_cache["key"] != cache_key:
+                with open(config_path, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
                 # 合并默认配置，确保所有配置项都存在
-                return {**default_config, **config}
+                _config_cache["config"] = {**default_config, **config}
+                _config_cache["key"] = cache_key
+            # 返回副本，调用方修改配置不会影响缓存
+            return copy.deepcopy(_config_cache["config"])
         else:
             return default_config
     except Exception as e:
@@ -63,6 +119,7 @@ def save_config(config):
         config_path = get_config_path()
         with open(config_path, 'w', encoding='utf-8') as f:
             json.dump(config, f, indent=2, ensure_ascii=False)
+        _config_cache["key"] = None
         return True
     except Exception as e:
         logging.error(f"Failed to save config: {e}")
@@ -72,7 +129,316 @@ def is_safe_path(base_path, target_path):
     """检查路径是否安全，防止目录遍历攻击"""
     base_path = os.path.abspath(base_path)
     target_path = os.path.abspath(target_path)
-    return target_path.startswith(base_path)
+    # 按路径分隔符比较，避免 /mnt/library 误匹配 /mnt/library-private
+    return target_path == base_path or target_path.startswith(base_path.rstrip(os.sep) + os.sep)
+
+class DirectoryListingCache:
+    """目录列表缓存，以目录修改时间校验，按缓存条目总数做LRU淘汰"""
+    
+    def __init__(self, max_items=LISTING_CACHE_MAX_ITEMS):
+        self.max_items = max_items
+        self.total_items = 0
+        self.entries = OrderedDict()  # 目录 -> (修改时间, [(名称, 是否目录)])
+    
+    def list_directory(self, directory):
+        """返回按名称排序的 [(名称, 是否目录)]，目录未变化时直接使用缓存"""
+        mtime_ns = os.stat(directory).st_mtime_ns
+        cached = self.entries.get(directory)
+        if cached and cached[0] == mtime_ns:
+            self.entries.move_to_end(directory)
+            return cached[1]
+        
+        with os.scandir(directory) as it:
+            listing = sorted((entry.name, entry.is_dir()) for entry in it)
+        
+        self._discard(directory)
+        if time.time_ns() - mtime_ns > LISTING_CACHE_RACY_WINDOW_NS and len(listing) <= self.max_items:
+            self.entries[directory] = (mtime_ns, listing)
+            self.total_items += len(listing)
+            while self.total_items > self.max_items:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.total_items -= len(evicted)
+        return listing
+    
+    def count_workflows(self, directory):
+        """统计目录中的工作流数量"""
+        return sum(1 for name, is_dir in self.list_directory(directory) if not is_dir and name.endswith('.json'))
+    
+    def _discard(self, directory):
+        cached = self.entries.pop(directory, None)
+        if cached:
+            self.total_items -= len(cached[1])
+
+class WorkflowRoot:
+    """工作流根目录，每个根目录拥有独立、延迟创建的目录缓存"""
+    
+    def __init__(self, directory, prefix='', read_only=False):
+        self.directory = os.path.abspath(directory)
+        self.prefix = prefix
+        self.read_only = read_only
+        self._listing_cache = None
+        self._revision_store = None
+    
+    @property
+    def listing_cache(self):
+        if self._listing_cache is None:
+            self._listing_cache = DirectoryListingCache()
+        return self._listing_cache
+    
+    @property
+    def revision_store(self):
+        """修订历史存储，位于工作流目录旁的 workflow_revisions 目录；只读根目录没有修订历史"""
+        if self.read_only:
+            return None
+        if self._revision_store is None:
+            revisions_dir = os.path.join(os.path.dirname(self.directory), 'workflow_revisions')
+            self._revision_store = RevisionStore(revisions_dir)
+        return self._revision_store
+    
+    def resolve(self, relative_path):
+        """将根目录内的相对路径转换为完整路径，路径越界时返回None"""
+        full_path = os.path.join(self.directory, relative_path) if relative_path else self.directory
+        if not is_safe_path(self.directory, full_path):
+            return None
+        return full_path
+    
+    def to_client_path(self, full_path):
+        """将完整路径转换为前端使用的路径（共享目录带虚拟前缀）"""
+        relative_path = os.path.relpath(full_path, self.directory).replace('\\', '/')
+        if relative_path == '.':
+            relative_path = ''
+        if not self.prefix:
+            return relative_path
+        return f"{self.prefix}/{relative_path}" if relative_path else self.prefix
+
+# 已创建的根目录，键为 ('user', 用户ID) 或 ('shared', 名称, 路径)
+workflow_roots = {}
+
+def get_request_user_id(request):
+    """获取请求对应的ComfyUI用户ID（多用户模式下来自Comfy-User请求头）"""
+    user_manager = getattr(PromptServer.instance, 'user_manager', None)
+    if user_manager is None:
+        return "default"
+    return user_manager.get_request_user_id(request)
+
+def get_user_root(user_id):
+    """获取用户的工作流根目录"""
+    key = ('user', user_id)
+    root = workflow_roots.get(key)
+    if root is None:
+        root = WorkflowRoot(ensure_workflows_directory(user_id))
+        workflow_roots[key] = root
+    return root
+
+def get_shared_roots():
+    """获取配置中的只读共享目录 {名称: WorkflowRoot}
+
+    配置格式：{"sharedRoots": [{"name": "团队库", "path": "/mnt/library"}]}
+    """
+    shared_roots = {}
+    for entry in load_config().get('sharedRoots', []):
+        name = str(entry.get('name', '')).strip()
+        path = str(entry.get('path', '')).strip()
+        if not name or not path or '/' in name or not os.path.isdir(path):
+            continue
+        
+        key = ('shared', name, os.path.abspath(path))
+        root = workflow_roots.get(key)
+        if root is None:
+            root = WorkflowRoot(path, prefix=f"{SHARED_ROOT_PREFIX}/{name}", read_only=True)
+            workflow_roots[key] = root
+        shared_roots[name] = root
+    return shared_roots
+
+def is_shared_prefix_shadowed(user_root):
+    """用户根目录下存在名为 @shared 的真实文件夹时，优先使用该文件夹，共享目录入口不再显示"""
+    return os.path.isdir(os.path.join(user_root.directory, SHARED_ROOT_PREFIX))
+
+def resolve_workflow_path(request, path):
+    """根据请求用户和路径确定所属根目录，返回(根目录, 完整路径)
+
+    以 @shared/<名称> 开头的路径指向共享目录，其余路径指向当前用户的目录。
+    根目录不存在或路径越界时返回的完整路径为None。
+    """
+    path = path.strip().replace('\\', '/')
+    user_root = get_user_root(get_request_user_id(request))
+    
+    if ((path == SHARED_ROOT_PREFIX or path.startswith(SHARED_ROOT_PREFIX + '/'))
+            and not is_shared_prefix_shadowed(user_root)):
+        parts = path.split('/', 2)
+        root = get_shared_roots().get(parts[1]) if len(parts) > 1 else None
+        if root is None:
+            return None, None
+        return root, root.resolve(parts[2] if len(parts) > 2 else '')
+    
+    return user_root, user_root.resolve(path)
+
+def revisions_enabled():
+    """是否启用了修订历史"""
+    return bool(load_config().get('revisionsEnabled'))
+
+def record_file_revision(root, full_path, op, **extra):
+    """读取工作流文件并记录新版本（会读取整个pack并计算增量，需在线程池中调用）
+
+    文件内容不是合法JSON时抛出 ValueError。
+    """
+    with open(full_path, 'rb') as f:
+        content = f.read()
+    return root.revision_store.record(root.to_client_path(full_path), content, op, **extra)
+
+def read_workflow_lines(full_path):
+    """读取工作流文件并切分为修订历史使用的文本片段（需在线程池中调用）"""
+    with open(full_path, 'rb') as f:
+        return split_workflow(f.read())
+
+async def record_workflow_revision(root, full_path, op, **extra):
+    """记录工作流的新版本，未启用修订历史或记录失败时不影响原操作"""
+    if root.read_only or not full_path.lower().endswith('.json') or not revisions_enabled():
+        return None
+    
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(
+            record_file_revision, root, full_path, op, **extra
+        ))
+    except Exception as e:
+        logging.warning(f"Failed to record revision for {full_path}: {e}")
+        return None
+
+async def move_workflow_revisions(root, old_full_path, new_full_path, op):
+    """工作流或文件夹改名/移动后同步移动修订历史，并为工作流记录一个版本"""
+    if root.read_only or not revisions_enabled():
+        return
+    
+    is_directory = os.path.isdir(new_full_path)
+    old_relative_path = root.to_client_path(old_full_path)
+    try:
+        # 与记录版本、清理共用同一把锁，需在线程池中等待
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, functools.partial(
+            root.revision_store.move, old_relative_path, root.to_client_path(new_full_path), is_directory
+        ))
+    except Exception as e:
+        logging.warning(f"Failed to move revisions for {old_full_path}: {e}")
+    
+    if not is_directory:
+        await record_workflow_revision(root, new_full_path, op, moved_from=old_relative_path)
+
+def read_only_response():
+    """共享目录写操作的统一错误响应"""
+    return web.json_response({"success": False, "error": "共享目录为只读"}, status=403)
+
+def find_preview_file(workflow_full_path, size=None, thumbnail_sizes=()):
+    """查找工作流对应的预览图文件，返回(预览图路径, content_type)
+
+    指定 size 时优先返回不小于该尺寸的最小缩略图。
+    """
+    base_path = os.path.splitext(workflow_full_path)[0]
+    if size:
+        for thumbnail_size in sorted(thumbnail_sizes):
+            thumbnail_path = base_path + thumbnail_suffix(thumbnail_size)
+            if thumbnail_size >= size and os.path.isfile(thumbnail_path):
+                return thumbnail_path, 'image/webp'
+    
+    for ext, content_type in PREVIEW_CONTENT_TYPES.items():
+        preview_path = base_path + ext
+        if os.path.isfile(preview_path):
+            return preview_path, content_type
+    return None, None
+
+def find_preview_sidecars(workflow_full_path):
+    """列出工作流的所有预览图文件（各格式预览图和缩略图），返回(完整路径, 后缀)列表"""
+    directory, filename = os.path.split(workflow_full_path)
+    stem = os.path.splitext(filename)[0]
+    
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    
+    sidecars = []
+    for name in sorted(names):
+        if not name.startswith(stem + '.'):
+            continue
+        suffix = name[len(stem):]
+        if suffix in PREVIEW_CONTENT_TYPES or THUMBNAIL_SUFFIX_PATTERN.fullmatch(suffix):
+            sidecars.append((os.path.join(directory, name), suffix))
+    return sidecars
+
+# 预览图处理线程池（首次上传时创建）
+# 不使用进程池：fork 多线程的ComfyUI进程可能死锁，spawn 会重新导入主程序；Pillow解码和编码时会释放GIL
+preview_executor = None
+
+def get_preview_executor():
+    """获取预览图处理线程池"""
+    global preview_executor
+    if preview_executor is None:
+        workers = max(1, int(load_config().get('previewWorkers', 2)))
+        preview_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='workflow-preview')
+    return preview_executor
+
+def install_preview_outputs(workflow_full_path, outputs):
+    """将转码结果原子替换到位，并清理其他格式的旧预览图和过期缩略图"""
+    base_path = os.path.splitext(workflow_full_path)[0]
+    installed = set()
+    
+    try:
+        for size, temp_path in outputs['thumbnails'].items():
+            target_path = base_path + thumbnail_suffix(size)
+            os.replace(temp_path, target_path)
+            installed.add(target_path)
+        
+        # 主预览图最后替换，客户端看到新版本时缩略图已经就绪
+        preview_path = base_path + '.webp'
+        os.replace(outputs['preview'], preview_path)
+        installed.add(preview_path)
+    except Exception:
+        discard_outputs(outputs)
+        raise
+    
+    for sidecar_path, _ in find_preview_sidecars(workflow_full_path):
+        if sidecar_path in installed:
+            continue
+        try:
+            os.remove(sidecar_path)
+            logging.info(f"Removed stale preview: {sidecar_path}")
+        except Exception as e:
+            logging.warning(f"Failed to remove stale preview {sidecar_path}: {e}")
+
+def get_preview_version(preview_path):
+    """根据修改时间和大小生成预览图版本号"""
+    stat = os.stat(preview_path)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+class LazyFilePayload(payload.Payload):
+    """写出时才打开文件的响应内容
+
+    批量响应中尚未写出的部分不持有文件句柄，客户端提前断开时也不会遗留打开的文件。
+    """
+    
+    CHUNK_SIZE = 64 * 1024
+    
+    async def write(self, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            f = await loop.run_in_executor(None, open, self._value, 'rb')
+        except OSError as e:
+            # 清单生成后文件被删除，该部分内容为空，客户端按无预览图处理
+            logging.warning(f"Preview disappeared before it was sent: {self._value}: {e}")
+            return
+        
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                await writer.write(chunk)
+        finally:
+            f.close()
+    
+    def decode(self, encoding='utf-8', errors='strict'):
+        with open(self._value, 'rb') as f:
+            return f.read().decode(encoding, errors)
 
 @PromptServer.instance.routes.post("/workflow-manager/save-view-mode")
 async def save_view_mode(request):
@@ -101,58 +467,98 @@ async def browse_directory(request):
     """浏览目录内容"""
     try:
         path = request.query.get('path', '').strip()
-        workflows_dir = ensure_workflows_directory()
         
-        if path:
-            target_dir = os.path.join(workflows_dir, path)
-        else:
-            target_dir = workflows_dir
-            
-        if not is_safe_path(workflows_dir, target_dir):
+        # 共享目录入口：列出所有已配置的共享目录
+        if path == SHARED_ROOT_PREFIX and not is_shared_prefix_shadowed(get_user_root(get_request_user_id(request))):
+            items = []
+            for name, root in sorted(get_shared_roots().items()):
+                items.append({
+                    "name": name,
+                    "type": "directory",
+                    "path": root.prefix,
+                    "size": 0,
+                    "modified": os.path.getmtime(root.directory),
+                    "workflow_count": root.listing_cache.count_workflows(root.directory),
+                    "read_only": True
+                })
+            return web.json_response({
+                "success": True,
+                "current_path": path,
+                "read_only": True,
+                "items": items,
+                "config": load_config()
+            })
+        
+        root, target_dir = resolve_workflow_path(request, path)
+        
+        if target_dir is None:
             return web.json_response({"success": False, "error": "无效的路径"}, status=400)
             
-        if not os.path.exists(target_dir):
+        if not os.path.isdir(target_dir):
             return web.json_response({"success": False, "error": "目录不存在"}, status=404)
         
         items = []
         
-        # 获取目录内容
-        for item_name in sorted(os.listdir(target_dir)):
+        # 获取目录内容（目录结构和子文件夹工作流数量使用缓存）
+        for item_name, is_dir in root.listing_cache.list_directory(target_dir):
             item_path = os.path.join(target_dir, item_name)
-            relative_path = os.path.relpath(item_path, workflows_dir).replace('\\', '/')
+            relative_path = root.to_client_path(item_path)
             
-            if os.path.isdir(item_path):
-                # 统计文件夹中的工作流数量
-                workflow_count = 0
+            try:
+                if is_dir:
+                    # 统计文件夹中的工作流数量
+                    try:
+                        workflow_count = root.listing_cache.count_workflows(item_path)
+                    except OSError:
+                        workflow_count = 0
+                        
+                    items.append({
+                        "name": item_name,
+                        "type": "directory",
+                        "path": relative_path,
+                        "size": 0,
+                        "modified": os.path.getmtime(item_path),
+                        "workflow_count": workflow_count,
+                        "read_only": root.read_only
+                    })
+                elif item_name.endswith('.json'):
+                    # 工作流文件（大小和修改时间每次读取，保证覆盖保存后信息准确）
+                    stat = os.stat(item_path)
+                    items.append({
+                        "name": item_name,
+                        "type": "workflow",
+                        "path": relative_path,
+                        "size": stat.st_size,
+                        "modified": stat.st_mtime,
+                        "read_only": root.read_only
+                    })
+            except FileNotFoundError:
+                # 缓存列出后文件已被删除
+                continue
+        
+        # 用户根目录下显示共享目录入口（已有同名真实文件夹时不显示）
+        shared_roots = get_shared_roots() if not path and not root.read_only else {}
+        if shared_roots and not is_shared_prefix_shadowed(root):
+            shared_mtimes = []
+            for shared_root in shared_roots.values():
                 try:
-                    for file in os.listdir(item_path):
-                        if file.endswith('.json'):
-                            workflow_count += 1
-                except:
-                    workflow_count = 0
-                    
-                items.append({
-                    "name": item_name,
-                    "type": "directory",
-                    "path": relative_path,
-                    "size": 0,
-                    "modified": os.path.getmtime(item_path),
-                    "workflow_count": workflow_count
-                })
-            elif item_name.endswith('.json'):
-                # 工作流文件
-                file_size = os.path.getsize(item_path)
-                items.append({
-                    "name": item_name,
-                    "type": "workflow",
-                    "path": relative_path,
-                    "size": file_size,
-                    "modified": os.path.getmtime(item_path)
-                })
+                    shared_mtimes.append(os.path.getmtime(shared_root.directory))
+                except OSError:
+                    continue
+            items.append({
+                "name": SHARED_ROOT_PREFIX,
+                "type": "directory",
+                "path": SHARED_ROOT_PREFIX,
+                "size": 0,
+                "modified": max(shared_mtimes, default=0),
+                "workflow_count": 0,
+                "read_only": True
+            })
         
         return web.json_response({
             "success": True,
             "current_path": path,
+            "read_only": root.read_only,
             "items": items,
             "config": load_config()  # 添加配置信息
         })
@@ -176,23 +582,23 @@ async def create_folder(request):
         if any(char in folder_name for char in r'<>:"/\|?*'):
             return web.json_response({"success": False, "error": "文件夹名称包含非法字符"}, status=400)
         
-        workflows_dir = ensure_workflows_directory()
-        
-        if parent_path:
-            target_dir = os.path.join(workflows_dir, parent_path, folder_name)
-        else:
-            target_dir = os.path.join(workflows_dir, folder_name)
+        root, parent_dir = resolve_workflow_path(request, parent_path)
         
-        if not is_safe_path(workflows_dir, target_dir):
+        if parent_dir is None:
             return web.json_response({"success": False, "error": "无效的路径"}, status=400)
         
+        if root.read_only:
+            return read_only_response()
+        
+        target_dir = os.path.join(parent_dir, folder_name)
+        
         if os.path.exists(target_dir):
             return web.json_response({"success": False, "error": "文件夹已存在"}, status=409)
         
         os.makedirs(target_dir, exist_ok=True)
         logging.info(f"Folder created: {target_dir}")
         
-        return web.json_response({"success": True, "path": os.path.relpath(target_dir, workflows_dir).replace('\\', '/')})
+        return web.json_response({"success": True, "path": root.to_client_path(target_dir)})
         
     except Exception as e:
         logging.error(f"Failed to create folder: {e}")
@@ -214,12 +620,14 @@ async def rename_item(request):
         if any(char in new_name for char in r'<>:"/\|?*'):
             return web.json_response({"success": False, "error": "名称包含非法字符"}, status=400)
         
-        workflows_dir = ensure_workflows_directory()
-        old_full_path = os.path.join(workflows_dir, old_path)
+        root, old_full_path = resolve_workflow_path(request, old_path)
         
-        if not is_safe_path(workflows_dir, old_full_path):
+        if old_full_path is None or old_full_path == root.directory:
             return web.json_response({"success": False, "error": "无效的路径"}, status=400)
         
+        if root.read_only:
+            return read_only_response()
+        
         if not os.path.exists(old_full_path):
             return web.json_response({"success": False, "error": "文件或文件夹不存在"}, status=404)
         
@@ -233,8 +641,6 @@ async def rename_item(request):
         # 如果是JSON工作流文件，查找并准备重命名预览图文件
         preview_files_to_rename = []
         if sync_preview and not os.path.isdir(old_full_path) and old_path.lower().endswith('.json'):
-            preview_extensions = ['.webp', '.png', '.jpg', '.jpeg', '.gif', '.bmp']
-            old_base_path = os.path.splitext(old_full_path)[0]
             
             # 确保新名称包含.json扩展名
             if not new_name.lower().endswith('.json'):
@@ -245,11 +651,8 @@ async def rename_item(request):
                 
             new_base_path = os.path.splitext(new_full_path)[0]
             
-            for ext in preview_extensions:
-                old_preview_path = old_base_path + ext
-                if os.path.exists(old_preview_path):
-                    new_preview_path = new_base_path + ext
-                    preview_files_to_rename.append((old_preview_path, new_preview_path))
+            for old_preview_path, suffix in find_preview_sidecars(old_full_path):
+                preview_files_to_rename.append((old_preview_path, new_base_path + suffix))
         
         # 重命名主文件或文件夹
         os.rename(old_full_path, new_full_path)
@@ -263,9 +666,11 @@ async def rename_item(request):
             except Exception as e:
                 logging.warning(f"Failed to rename preview {old_preview}: {e}")
         
+        await move_workflow_revisions(root, old_full_path, new_full_path, 'rename')
+        
         return web.json_response({
             "success": True, 
-            "new_path": os.path.relpath(new_full_path, workflows_dir).replace('\\', '/')
+            "new_path": root.to_client_path(new_full_path)
         })
         
     except Exception as e:
@@ -283,12 +688,14 @@ async def delete_item(request):
         if not item_path:
             return web.json_response({"success": False, "error": "路径不能为空"}, status=400)
         
-        workflows_dir = ensure_workflows_directory()
-        full_path = os.path.join(workflows_dir, item_path)
+        root, full_path = resolve_workflow_path(request, item_path)
         
-        if not is_safe_path(workflows_dir, full_path):
+        if full_path is None or full_path == root.directory:
             return web.json_response({"success": False, "error": "无效的路径"}, status=400)
         
+        if root.read_only:
+            return read_only_response()
+        
         if not os.path.exists(full_path):
             return web.json_response({"success": False, "error": "文件或文件夹不存在"}, status=404)
         
@@ -296,13 +703,8 @@ async def delete_item(request):
         preview_files_to_delete = []
         if sync_preview and not os.path.isdir(full_path) and item_path.lower().endswith('.json'):
             # 查找对应的预览图文件
-            preview_extensions = ['.webp', '.png', '.jpg', '.jpeg', '.gif', '.bmp']
-            base_path = os.path.splitext(full_path)[0]
-            
-            for ext in preview_extensions:
-                preview_path = base_path + ext
-                if os.path.exists(preview_path):
-                    preview_files_to_delete.append(preview_path)
+            for preview_path, _ in find_preview_sidecars(full_path):
+                preview_files_to_delete.append(preview_path)
         
         # 删除主文件或文件夹
         if os.path.isdir(full_path):
@@ -338,17 +740,16 @@ async def move_item(request):
         if not source_path:
             return web.json_response({"success": False, "error": "源路径不能为空"}, status=400)
         
-        workflows_dir = ensure_workflows_directory()
-        source_full_path = os.path.join(workflows_dir, source_path)
-        
-        if target_dir:
-            target_full_dir = os.path.join(workflows_dir, target_dir)
-        else:
-            target_full_dir = workflows_dir
+        source_root, source_full_path = resolve_workflow_path(request, source_path)
+        target_root, target_full_dir = resolve_workflow_path(request, target_dir)
         
-        if not is_safe_path(workflows_dir, source_full_path) or not is_safe_path(workflows_dir, target_full_dir):
+        if source_full_path is None or target_full_dir is None or source_full_path == source_root.directory:
             return web.json_response({"success": False, "error": "无效的路径"}, status=400)
         
+        # 移动会修改源目录，源和目标都必须可写
+        if source_root.read_only or target_root.read_only:
+            return read_only_response()
+        
         if not os.path.exists(source_full_path):
             return web.json_response({"success": False, "error": "源文件不存在"}, status=404)
         
@@ -364,15 +765,10 @@ async def move_item(request):
         # 如果是JSON工作流文件，查找并准备移动预览图文件
         preview_files_to_move = []
         if sync_preview and not os.path.isdir(source_full_path) and source_path.lower().endswith('.json'):
-            preview_extensions = ['.webp', '.png', '.jpg', '.jpeg', '.gif', '.bmp']
-            source_base_path = os.path.splitext(source_full_path)[0]
             target_base_path = os.path.splitext(target_full_path)[0]
             
-            for ext in preview_extensions:
-                source_preview_path = source_base_path + ext
-                if os.path.exists(source_preview_path):
-                    target_preview_path = target_base_path + ext
-                    preview_files_to_move.append((source_preview_path, target_preview_path))
+            for source_preview_path, suffix in find_preview_sidecars(source_full_path):
+                preview_files_to_move.append((source_preview_path, target_base_path + suffix))
         
         # 移动主文件或文件夹
         shutil.move(source_full_path, target_full_path)
@@ -386,9 +782,11 @@ async def move_item(request):
             except Exception as e:
                 logging.warning(f"Failed to move preview {source_preview}: {e}")
         
+        await move_workflow_revisions(source_root, source_full_path, target_full_path, 'move')
+        
         return web.json_response({
             "success": True,
-            "new_path": os.path.relpath(target_full_path, workflows_dir).replace('\\', '/')
+            "new_path": target_root.to_client_path(target_full_path)
         })
         
     except Exception as e:
@@ -407,17 +805,16 @@ async def copy_item(request):
         if not source_path:
             return web.json_response({"success": False, "error": "源路径不能为空"}, status=400)
         
-        workflows_dir = ensure_workflows_directory()
-        source_full_path = os.path.join(workflows_dir, source_path)
-        
-        if target_dir:
-            target_full_dir = os.path.join(workflows_dir, target_dir)
-        else:
-            target_full_dir = workflows_dir
+        source_root, source_full_path = resolve_workflow_path(request, source_path)
+        target_root, target_full_dir = resolve_workflow_path(request, target_dir)
         
-        if not is_safe_path(workflows_dir, source_full_path) or not is_safe_path(workflows_dir, target_full_dir):
+        if source_full_path is None or target_full_dir is None or source_full_path == source_root.directory:
             return web.json_response({"success": False, "error": "无效的路径"}, status=400)
         
+        # 允许从共享目录复制到自己的目录，但不能复制到共享目录
+        if target_root.read_only:
+            return read_only_response()
+        
         if not os.path.exists(source_full_path):
             return web.json_response({"success": False, "error": "源文件不存在"}, status=404)
         
@@ -442,15 +839,10 @@ async def copy_item(request):
         # 如果是JSON工作流文件，查找并准备复制预览图文件
         preview_files_to_copy = []
         if sync_preview and not os.path.isdir(source_full_path) and source_path.lower().endswith('.json'):
-            preview_extensions = ['.webp', '.png', '.jpg', '.jpeg', '.gif', '.bmp']
-            source_base_path = os.path.splitext(source_full_path)[0]
             target_base_path = os.path.splitext(target_full_path)[0]
             
-            for ext_preview in preview_extensions:
-                source_preview_path = source_base_path + ext_preview
-                if os.path.exists(source_preview_path):
-                    target_preview_path = target_base_path + ext_preview
-                    preview_files_to_copy.append((source_preview_path, target_preview_path))
+            for source_preview_path, suffix in find_preview_sidecars(source_full_path):
+                preview_files_to_copy.append((source_preview_path, target_base_path + suffix))
         
         # 复制主文件或文件夹
         if os.path.isdir(source_full_path):
@@ -470,7 +862,7 @@ async def copy_item(request):
         
         return web.json_response({
             "success": True,
-            "new_path": os.path.relpath(target_full_path, workflows_dir).replace('\\', '/')
+            "new_path": target_root.to_client_path(target_full_path)
         })
         
     except Exception as e:
@@ -486,13 +878,12 @@ async def read_workflow(request):
         if not workflow_path:
             return web.json_response({"success": False, "error": "工作流路径不能为空"}, status=400)
         
-        workflows_dir = ensure_workflows_directory()
-        full_path = os.path.join(workflows_dir, workflow_path)
+        root, full_path = resolve_workflow_path(request, workflow_path)
         
-        if not is_safe_path(workflows_dir, full_path):
+        if full_path is None:
             return web.json_response({"success": False, "error": "无效的路径"}, status=400)
         
-        if not os.path.exists(full_path):
+        if not os.path.isfile(full_path):
             return web.json_response({"success": False, "error": "工作流文件不存在"}, status=404)
         
         with open(full_path, 'r', encoding='utf-8') as f:
@@ -515,103 +906,224 @@ async def get_workflow_preview(request):
         if not path:
             return web.Response(status=400, text='Path is required')
         
-        workflows_dir = ensure_workflows_directory()
+        root, workflow_full_path = resolve_workflow_path(request, path)
         
-        # 构建预览图路径（将.json替换为.webp）
-        preview_path = os.path.join(workflows_dir, path.replace('.json', '.webp'))
+        if workflow_full_path is None:
+            return web.Response(status=400, text='Invalid path')
         
-        # 检查文件是否存在
-        if os.path.exists(preview_path):
-            # 读取webp文件
-            with open(preview_path, 'rb') as f:
-                content = f.read()
-            
-            # 返回webp图片，设置缓存头 - 禁用缓存
-            return web.Response(
-                body=content,
-                content_type='image/webp',
-                headers={
-                    'Cache-Control': 'no-cache, no-store, must-revalidate',  # 禁用缓存
-                    'Pragma': 'no-cache',  # HTTP/1.0兼容
-                    'Expires': '0',  # 立即过期
-                    'Access-Control-Allow-Origin': '*'
-                }
-            )
-        else:
-            # 预览图不存在，尝试查找其他格式
-            # 尝试其他图片格式
-            base_path = os.path.splitext(preview_path)[0]
-            alternative_formats = ['.png', '.jpg', '.jpeg', '.gif', '.bmp']
-            
-            for ext in alternative_formats:
-                alt_path = base_path + ext
-                if os.path.exists(alt_path):
-                    # 确定正确的content-type
-                    content_type_map = {
-                        '.png': 'image/png',
-                        '.jpg': 'image/jpeg',
-                        '.jpeg': 'image/jpeg',
-                        '.gif': 'image/gif',
-                        '.bmp': 'image/bmp'
-                    }
-                    
-                    content_type = content_type_map.get(ext, 'image/png')
-                    
-                    with open(alt_path, 'rb') as f:
-                        content = f.read()
-                    
-                    return web.Response(
-                        body=content,
-                        content_type=content_type,
-                        headers={
-                            'Cache-Control': 'no-cache, no-store, must-revalidate',  # 禁用缓存
-                            'Pragma': 'no-cache',  # HTTP/1.0兼容
-                            'Expires': '0',  # 立即过期
-                            'Access-Control-Allow-Origin': '*'
-                        }
-                    )
-            
+        # 按优先级查找预览图（指定尺寸时优先缩略图，其次.webp和其他格式）
+        try:
+            size = int(request.query.get('size', 0))
+        except ValueError:
+            size = 0
+        preview_path, content_type = find_preview_file(
+            workflow_full_path, size, load_config().get('previewThumbnailSizes', [])
+        )
+        if not preview_path:
             # 如果都没有找到，返回404
             return web.Response(status=404, text='Preview not found')
+        
+        with open(preview_path, 'rb') as f:
+            content = f.read()
+        
+        return web.Response(
+            body=content,
+            content_type=content_type,
+            headers={
+                **PREVIEW_NO_CACHE_HEADERS,
+                'X-Preview-Version': get_preview_version(preview_path)
+            }
+        )
                 
     except Exception as e:
         logging.error(f"Failed to serve preview: {e}")
         return web.Response(status=500, text='Internal server error')
 
+@PromptServer.instance.routes.post("/workflow-manager/preview-batch")
+async def get_workflow_previews_batch(request):
+    """批量获取工作流预览图
+    
+    请求体可以是 {"paths": [...]}，也可以是 {"folder": ..., "cursor": ..., "limit": ...}
+    按文件夹分页；"known" 为客户端已有的 {路径: 版本号}，版本未变的预览图不再返回；
+    "size" 为显示尺寸，存在合适的缩略图时返回缩略图。
+    响应为 multipart/form-data：第一个字段 manifest 是JSON清单，其余字段是预览图文件。
+    """
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return web.json_response({"success": False, "error": "请求体必须是JSON对象"}, status=400)
+        
+        paths = data.get('paths')
+        known = data.get('known') or {}
+        if not isinstance(known, dict):
+            return web.json_response({"success": False, "error": "known必须是对象"}, status=400)
+        next_cursor = None
+        
+        # 指定显示尺寸时优先返回预生成的缩略图
+        try:
+            size = int(data.get('size') or 0)
+        except (TypeError, ValueError):
+            size = 0
+        thumbnail_sizes = load_config().get('previewThumbnailSizes', [])
+        
+        if paths is None:
+            # 按文件夹分页列出工作流
+            folder = str(data.get('folder', '')).strip()
+            try:
+                cursor = max(int(data.get('cursor') or 0), 0)
+                limit = int(data.get('limit') or PREVIEW_BATCH_DEFAULT_LIMIT)
+            except (TypeError, ValueError):
+                return web.json_response({"success": False, "error": "无效的分页参数"}, status=400)
+            limit = min(max(limit, 1), PREVIEW_BATCH_MAX_ITEMS)
+            
+            root, folder_dir = resolve_workflow_path(request, folder)
+            if folder_dir is None:
+                return web.json_response({"success": False, "error": "无效的路径"}, status=400)
+            if not os.path.isdir(folder_dir):
+                return web.json_response({"success": False, "error": "目录不存在"}, status=404)
+            
+            workflow_names = [
+                name for name, is_dir in root.listing_cache.list_directory(folder_dir)
+                if not is_dir and name.endswith('.json')
+            ]
+            page = workflow_names[cursor:cursor + limit]
+            paths = [root.to_client_path(os.path.join(folder_dir, name)) for name in page]
+            if cursor + limit < len(workflow_names):
+                next_cursor = cursor + limit
+        elif not isinstance(paths, list):
+            return web.json_response({"success": False, "error": "paths必须是列表"}, status=400)
+        
+        if len(paths) > PREVIEW_BATCH_MAX_ITEMS:
+            return web.json_response({
+                "success": False,
+                "error": f"单次最多请求 {PREVIEW_BATCH_MAX_ITEMS} 个预览图"
+            }, status=400)
+        
+        items = []
+        preview_files = []
+        
+        for index, path in enumerate(paths):
+            if not isinstance(path, str) or not path.strip():
+                items.append({"path": path, "status": "invalid"})
+                continue
+            
+            root, workflow_full_path = resolve_workflow_path(request, path)
+            if workflow_full_path is None:
+                items.append({"path": path, "status": "invalid"})
+                continue
+            
+            preview_path, content_type = find_preview_file(workflow_full_path, size, thumbnail_sizes)
+            if not preview_path:
+                items.append({"path": path, "status": "missing"})
+                continue
+            
+            version = get_preview_version(preview_path)
+            if known.get(path) == version:
+                # 客户端已有最新版本，跳过图片内容
+                items.append({"path": path, "status": "not_modified", "version": version})
+                continue
+            
+            field_name = f"preview_{index}"
+            items.append({"path": path, "status": "ok", "version": version, "field": field_name})
+            preview_files.append((field_name, preview_path, content_type))
+        
+        writer = MultipartWriter('form-data')
+        manifest_part = writer.append_json({
+            "success": True,
+            "items": items,
+            "next_cursor": next_cursor
+        })
+        manifest_part.set_content_disposition('form-data', name='manifest')
+        
+        # 预览图文件在写出时才打开并以流的方式发送，不整体读入内存
+        for field_name, preview_path, content_type in preview_files:
+            part = writer.append_payload(LazyFilePayload(preview_path, content_type=content_type))
+            part.set_content_disposition('form-data', name=field_name, filename=os.path.basename(preview_path))
+        
+        return web.Response(body=writer, headers=PREVIEW_NO_CACHE_HEADERS)
+        
+    except Exception as e:
+        logging.error(f"Failed to serve preview batch: {e}")
+        return web.json_response({"success": False, "error": str(e)}, status=500)
+
 @PromptServer.instance.routes.post("/workflow-manager/upload-preview")
 async def upload_workflow_preview(request):
-    """上传工作流预览图"""
+    """上传工作流预览图（校验格式、转码为WebP并生成缩略图）"""
+    temp_source_path = None
     try:
-        data = await request.post()
-        workflow_path = data.get('workflow_path', '').strip()
-        preview_file = data.get('preview_file')
+        config = load_config()
+        max_upload_bytes = int(config['previewMaxUploadMB']) * 1024 * 1024
         
-        if not workflow_path or not preview_file:
+        # 以流的方式解析上传内容，图片写入临时文件
+        reader = await request.multipart()
+        workflow_path = ''
+        
+        field = await reader.next()
+        while field is not None:
+            if field.name == 'workflow_path':
+                workflow_path = (await field.read()).decode('utf-8').strip()
+            elif field.name == 'preview_file' and field.filename and temp_source_path is None:
+                fd, temp_source_path = tempfile.mkstemp(prefix='workflow-preview-', suffix='.upload')
+                received = 0
+                with os.fdopen(fd, 'wb') as f:
+                    while True:
+                        chunk = await field.read_chunk()
+                        if not chunk:
+                            break
+                        received += len(chunk)
+                        if received > max_upload_bytes:
+                            return web.json_response({
+                                "success": False,
+                                "error": f"预览图不能超过 {config['previewMaxUploadMB']} MB"
+                            }, status=413)
+                        f.write(chunk)
+            
+            field = await reader.next()
+        
+        if not workflow_path or temp_source_path is None:
             return web.json_response({"success": False, "error": "参数不完整"}, status=400)
         
-        workflows_dir = ensure_workflows_directory()
-        workflow_full_path = os.path.join(workflows_dir, workflow_path)
+        root, workflow_full_path = resolve_workflow_path(request, workflow_path)
         
-        if not is_safe_path(workflows_dir, workflow_full_path):
+        if workflow_full_path is None:
             return web.json_response({"success": False, "error": "无效的路径"}, status=400)
         
+        if root.read_only:
+            return read_only_response()
+        
         if not os.path.exists(workflow_full_path):
             return web.json_response({"success": False, "error": "工作流文件不存在"}, status=404)
         
-        # 构建预览图路径（将.json替换为.webp）
-        preview_path = workflow_full_path.replace('.json', '.webp')
+        # 在线程池中校验格式并转码，避免阻塞事件循环
+        loop = asyncio.get_running_loop()
+        try:
+            outputs = await loop.run_in_executor(
+                get_preview_executor(),
+                transcode_preview,
+                temp_source_path,
+                os.path.dirname(workflow_full_path),
+                int(config['previewMaxSize']),
+                int(config['previewQuality']),
+                [int(size) for size in config['previewThumbnailSizes']]
+            )
+        except ValueError as e:
+            return web.json_response({"success": False, "error": str(e)}, status=400)
         
-        # 保存预览图文件
-        with open(preview_path, 'wb') as f:
-            f.write(preview_file.file.read())
+        install_preview_outputs(workflow_full_path, outputs)
         
-        logging.info(f"Uploaded preview for: {workflow_path}")
+        logging.info(f"Uploaded preview for: {workflow_path} (source format: {outputs['format']})")
         
         return web.json_response({"success": True})
         
     except Exception as e:
         logging.error(f"Failed to upload preview: {e}")
         return web.json_response({"success": False, "error": str(e)}, status=500)
+    finally:
+        if temp_source_path and os.path.exists(temp_source_path):
+            os.remove(temp_source_path)
 
 @PromptServer.instance.routes.post("/workflow-manager/upload-workflow")
 async def upload_workflow_file(request):
@@ -660,18 +1172,16 @@ async def upload_workflow_file(request):
         if not workflow_files:
             return web.json_response({"success": False, "error": "没有有效的工作流文件"}, status=400)
         
-        workflows_dir = ensure_workflows_directory()
-        
         # 确定目标目录
-        if target_dir:
-            target_full_dir = os.path.join(workflows_dir, target_dir)
-        else:
-            target_full_dir = workflows_dir
+        root, target_full_dir = resolve_workflow_path(request, target_dir)
         
         # 安全检查
-        if not is_safe_path(workflows_dir, target_full_dir):
+        if target_full_dir is None:
             return web.json_response({"success": False, "error": "无效的目标路径"}, status=400)
         
+        if root.read_only:
+            return read_only_response()
+        
         # 如果允许创建目录且目录不存在，则创建它
         if create_dirs and not os.path.exists(target_full_dir):
             try:
@@ -711,7 +1221,7 @@ async def upload_workflow_file(request):
                     f.write(content)
                 
                 final_filename = os.path.basename(target_file_path)
-                relative_path = os.path.relpath(target_file_path, workflows_dir).replace('\\', '/')
+                relative_path = root.to_client_path(target_file_path)
                 
                 uploaded_files.append({
                     'filename': final_filename,
@@ -720,6 +1230,8 @@ async def upload_workflow_file(request):
                 
                 logging.info(f"Uploaded workflow file: {target_file_path}")
                 
+                await record_workflow_revision(root, target_file_path, 'upload')
+                
             except Exception as e:
                 errors.append(f"{filename}: {str(e)}")
                 logging.error(f"Failed to save workflow file {filename}: {e}")
@@ -746,6 +1258,205 @@ async def upload_workflow_file(request):
         logging.error(f"Failed to upload workflow files: {e}")
         return web.json_response({"success": False, "error": str(e)}, status=500)
 
+def resolve_revision_store(request, path):
+    """解析工作流路径对应的修订历史，返回(根目录, 完整路径, 错误响应)"""
+    if not path:
+        return None, None, web.json_response({"success": False, "error": "工作流路径不能为空"}, status=400)
+    
+    root, full_path = resolve_workflow_path(request, path)
+    
+    if full_path is None or not path.lower().endswith('.json'):
+        return None, None, web.json_response({"success": False, "error": "无效的路径"}, status=400)
+    
+    if root.read_only:
+        return None, None, web.json_response({"success": False, "error": "共享目录没有修订历史"}, status=400)
+    
+    return root, full_path, None
+
+@PromptServer.instance.routes.get("/workflow-manager/revisions")
+async def list_workflow_revisions(request):
+    """列出工作流的修订历史"""
+    try:
+        path = request.query.get('path', '').strip()
+        root, full_path, error_response = resolve_revision_store(request, path)
+        if error_response:
+            return error_response
+        
+        relative_path = root.to_client_path(full_path)
+        # 记录版本时会持有同一把锁，不能在事件循环中等待
+        loop = asyncio.get_running_loop()
+        revisions = await loop.run_in_executor(None, root.revision_store.list_revisions, relative_path)
+        
+        return web.json_response({
+            "success": True,
+            "enabled": revisions_enabled(),
+            "revisions": revisions
+        })
+        
+    except Exception as e:
+        logging.error(f"Failed to list revisions: {e}")
+        return web.json_response({"success": False, "error": str(e)}, status=500)
+
+@PromptServer.instance.routes.get("/workflow-manager/revisions/diff")
+async def diff_workflow_revisions(request):
+    """比较工作流的两个版本，to 为空或 current 时与当前文件比较"""
+    try:
+        path = request.query.get('path', '').strip()
+        root, full_path, error_response = resolve_revision_store(request, path)
+        if error_response:
+            return error_response
+        
+        try:
+            from_rev = int(request.query.get('from', ''))
+            to_param = request.query.get('to', 'current').strip() or 'current'
+            to_rev = None if to_param == 'current' else int(to_param)
+        except ValueError:
+            return web.json_response({"success": False, "error": "无效的版本号"}, status=400)
+        
+        relative_path = root.to_client_path(full_path)
+        store = root.revision_store
+        loop = asyncio.get_running_loop()
+        
+        try:
+            from_lines = await loop.run_in_executor(None, store.get_lines, relative_path, from_rev)
+            if to_rev is None:
+                if not os.path.isfile(full_path):
+                    return web.json_response({"success": False, "error": "工作流文件不存在"}, status=404)
+                to_lines = await loop.run_in_executor(None, read_workflow_lines, full_path)
+            else:
+                to_lines = await loop.run_in_executor(None, store.get_lines, relative_path, to_rev)
+        except KeyError as e:
+            return web.json_response({"success": False, "error": str(e.args[0])}, status=404)
+        
+        diff = await loop.run_in_executor(
+            None, diff_lines, relative_path, from_lines, to_lines, from_rev, to_param
+        )
+        
+        return web.json_response({"success": True, "diff": diff})
+        
+    except Exception as e:
+        logging.error(f"Failed to diff revisions: {e}")
+        return web.json_response({"success": False, "error": str(e)}, status=500)
+
+def write_restored_workflow(full_path, lines):
+    """写入临时文件后原子替换工作流文件"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(full_path), prefix='.restore-', suffix='.tmp')
+    try:
+        # 以二进制写入，保持原始文档的换行符
+        with os.fdopen(fd, 'wb') as f:
+            f.write(''.join(lines).encode('utf-8'))
+        os.replace(temp_path, full_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+@PromptServer.instance.routes.post("/workflow-manager/revisions/restore")
+async def restore_workflow_revision(request):
+    """将工作流恢复到指定版本"""
+    try:
+        data = await request.json()
+        path = data.get('path', '').strip()
+        root, full_path, error_response = resolve_revision_store(request, path)
+        if error_response:
+            return error_response
+        
+        try:
+            rev = int(data.get('rev'))
+        except (TypeError, ValueError):
+            return web.json_response({"success": False, "error": "无效的版本号"}, status=400)
+        
+        relative_path = root.to_client_path(full_path)
+        loop = asyncio.get_running_loop()
+        
+        try:
+            lines = await loop.run_in_executor(None, root.revision_store.get_lines, relative_path, rev)
+        except KeyError as e:
+            return web.json_response({"success": False, "error": str(e.args[0])}, status=404)
+        
+        if not os.path.isdir(os.path.dirname(full_path)):
+            return web.json_response({"success": False, "error": "目标目录不存在"}, status=404)
+        
+        # 先记录当前内容，避免恢复后丢失尚未记录的修改
+        # 无论是否启用修订历史都要记录；记录失败时取消恢复，只有当前文件无法解析时跳过
+        if os.path.isfile(full_path):
+            try:
+                await loop.run_in_executor(None, record_file_revision, root, full_path, 'save')
+            except ValueError as e:
+                logging.warning(f"Current workflow is not valid JSON, restoring without snapshot: {full_path}: {e}")
+            except Exception as e:
+                logging.error(f"Failed to snapshot workflow before restore: {e}")
+                return web.json_response({"success": False, "error": f"保存当前版本失败，已取消恢复: {e}"}, status=500)
+        
+        await loop.run_in_executor(None, write_restored_workflow, full_path, lines)
+        
+        logging.info(f"Restored workflow {full_path} to revision {rev}")
+        try:
+            new_rev = await loop.run_in_executor(None, functools.partial(
+                record_file_revision, root, full_path, 'restore', restored_from=rev
+            ))
+        except Exception as e:
+            logging.warning(f"Failed to record restored revision for {full_path}: {e}")
+            new_rev = None
+        
+        return web.json_response({"success": True, "rev": new_rev})
+        
+    except Exception as e:
+        logging.error(f"Failed to restore revision: {e}")
+        return web.json_response({"success": False, "error": str(e)}, status=500)
+
+@PromptServer.instance.routes.post("/workflow-manager/revisions/gc")
+async def gc_workflow_revisions(request):
+    """按大小预算清理当前用户的修订历史"""
+    try:
+        data = await request.json() if request.can_read_body else {}
+        try:
+            max_mb = float(data.get('max_mb') or load_config().get('revisionsMaxMB', 256))
+        except (TypeError, ValueError):
+            return web.json_response({"success": False, "error": "无效的大小预算"}, status=400)
+        
+        root = get_user_root(get_request_user_id(request))
+        loop = asyncio.get_running_loop()
+        stats = await loop.run_in_executor(None, root.revision_store.gc, int(max_mb * 1024 * 1024))
+        
+        logging.info(f"Revision GC for {root.directory}: {stats}")
+        return web.json_response({"success": True, **stats})
+        
+    except Exception as e:
+        logging.error(f"Failed to collect revisions: {e}")
+        return web.json_response({"success": False, "error": str(e)}, status=500)
+
+@web.middleware
+async def workflow_revision_middleware(request, handler):
+    """ComfyUI通过 /userdata 接口保存或移动工作流后记录修订版本"""
+    response = await handler(request)
+    
+    try:
+        if request.method != 'POST' or response.status != 200 or '/userdata/' not in request.path:
+            return response
+        
+        file_path = request.match_info.get('file', '').replace('\\', '/')
+        if not file_path.startswith('workflows/') or not revisions_enabled():
+            return response
+        
+        root = get_user_root(get_request_user_id(request))
+        full_path = root.resolve(file_path[len('workflows/'):])
+        if full_path is None:
+            return response
+        
+        dest_path = request.match_info.get('dest', '').replace('\\', '/')
+        if dest_path:
+            # 工作流改名或移动
+            new_full_path = root.resolve(dest_path[len('workflows/'):]) if dest_path.startswith('workflows/') else None
+            if new_full_path is not None:
+                await move_workflow_revisions(root, full_path, new_full_path, 'rename')
+        else:
+            await record_workflow_revision(root, full_path, 'save')
+    except Exception as e:
+        logging.warning(f"Failed to record workflow revision: {e}")
+    
+    return response
+
 def setup():
     print(f"🚀 ComfyUI Workflow Manager v{__version__} loaded!")
     
@@ -755,5 +1466,11 @@ def setup():
         print(f"   ✅ Workflows directory ready: {workflows_dir}")
     except Exception as e:
         print(f"   ❌ Failed to setup workflows directory: {e}")
+    
+    # 注册中间件，记录ComfyUI自身保存工作流时的修订版本
+    try:
+        PromptServer.instance.app.middlewares.append(workflow_revision_middleware)
+    except Exception as e:
+        print(f"   ⚠️ Failed to register revision middleware: {e}")
 
 setup() 
@@ -15,6 +15,7 @@ import {
     updateStatusBar,
     setLoadDirectoryRef
 } from './workflow_state.js';
+import { previewScheduler } from './workflow_preview.js';
 
 // 本地isLoading变量
 let isLoading = false;
@@ -125,6 +126,7 @@ async function renderFileGrid(items) {
     const emptyState = document.querySelector('#emptyState');
     
     if (items.length === 0) {
+        previewScheduler.reset();
         if (fileGrid) fileGrid.style.display = 'none';
         if (emptyState) emptyState.style.display = 'flex';
         return;
@@ -190,10 +192,8 @@ async function renderFileGrid(items) {
         rebindExpandIconEvents();
     }
     
-    // 如果是网格视图，加载预览图
-    if (!fileGrid.classList.contains('list-view')) {
-        loadPreviewsForWorkflows();
-    }
+    // 网格视图下加载预览图，列表视图下停止未完成的预览图请求
+    loadPreviewsForWorkflows();
     
     // 重新获取并恢复已展开文件夹的最新内容
     for (const folderPath of managerState.expandedFolders) {
@@ -628,55 +628,18 @@ function initializeEventListeners() {
 }
 
 // 预览图加载函数
-async function loadPreviewsForWorkflows() {
+function loadPreviewsForWorkflows() {
     // 检查当前视图模式 - 只在网格视图下加载预览图
     const fileGrid = document.querySelector('#fileGrid');
-    if (fileGrid.classList.contains('list-view')) {
+    if (!fileGrid || fileGrid.classList.contains('list-view')) {
+        previewScheduler.reset();
         return;
     }
     
-    // 网格视图下：显示预览图
-    const workflowItems = document.querySelectorAll('.file-item[data-type="workflow"]');
-    
-    for (const item of workflowItems) {
-        const path = item.dataset.path;
-        const iconElement = item.querySelector('.file-icon');
-        const previewPlaceholder = item.querySelector('.preview-placeholder');
-        
-        if (iconElement && previewPlaceholder) {
-            try {
-                // 动态导入预览图加载函数
-                const { loadWorkflowPreview } = await import('./workflow_state.js');
-                const previewImg = await loadWorkflowPreview(path);
-                
-                if (previewImg) {
-                    // 隐藏图标，显示预览图
-                    iconElement.style.display = 'none';
-                    previewPlaceholder.style.display = 'block';
-                    previewPlaceholder.innerHTML = '';
-                    previewPlaceholder.appendChild(previewImg);
-                    
-                    // 添加预览图样式
-                    previewImg.style.cssText = `
-                        width: 100%;
-                        height: 100%;
-                        object-fit: contain;
-                        border-radius: 4px;
-                        background: var(--comfy-input-bg, #2d2d2d);
-                    `;
-                } else {
-                    // 预览图加载失败，保持图标显示
-                    iconElement.style.display = 'block';
-                    previewPlaceholder.style.display = 'none';
-                }
-            } catch (error) {
-                console.error(`${PLUGIN_NAME}: Error loading preview for ${path}:`, error);
-                // 错误时保持图标显示
-                iconElement.style.display = 'block';
-                previewPlaceholder.style.display = 'none';
-            }
-        }
-    }
+    // 网格视图下：交给调度器按可见性优先级加载预览图
+    const workflowItems = Array.from(document.querySelectorAll('.file-item[data-type="workflow"]'));
+    const managerContent = document.querySelector('#managerContent');
+    previewScheduler.observe(workflowItems, managerContent);
 }
 
 // 导出主要函数
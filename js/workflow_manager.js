@@ -73,7 +73,7 @@ function createWorkflowManagerTab() {
 
                     // 获取配置并应用视图模式，然后再加载目录
                     try {
-                        const response = await fetch('/workflow-manager/browse?path=');
+                        const response = await api.fetchApi('/workflow-manager/browse?path=');
                         if (response.ok) {
                             const result = await response.json();
                             const config = result.config || {};
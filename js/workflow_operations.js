@@ -11,6 +11,7 @@ import {
     showLoading,
     clearSelection,
     addSelection,
+    loadWorkflowPreview,
     WORKFLOW_FILE_ICON_PATH
 } from './workflow_state.js';
 
@@ -1233,13 +1234,10 @@ async function refreshWorkflowPreview(path) {
         // 强制清除现有的预览图
         previewPlaceholder.innerHTML = '';
         
-        // 创建新的图片元素，添加强制刷新参数
-        const newPreviewImg = document.createElement('img');
-        const timestamp = Date.now();
-        const previewUrl = `/workflow-manager/preview?path=${encodeURIComponent(path)}&t=${timestamp}`;
+        // 通过api重新加载（缓存已清除，会向服务端请求最新图片）
+        const newPreviewImg = await loadWorkflowPreview(path);
         
-        newPreviewImg.crossOrigin = 'anonymous';
-        newPreviewImg.onload = () => {
+        if (newPreviewImg) {
             // 隐藏图标，显示预览图
             iconElement.style.display = 'none';
             previewPlaceholder.style.display = 'block';
@@ -1257,22 +1255,14 @@ async function refreshWorkflowPreview(path) {
                 background: var(--comfy-input-bg, #2d2d2d);
             `;
             
-            // 更新缓存
-            managerState.imageCache.set(path, newPreviewImg);
-            
             showToast(`预览图刷新成功`, 'success');
-        };
-        
-        newPreviewImg.onerror = (error) => {
-            console.error(`${PLUGIN_NAME}: Failed to load refreshed preview for ${path}:`, error);
+        } else {
+            console.error(`${PLUGIN_NAME}: Failed to load refreshed preview for ${path}`);
             // 预览图加载失败，恢复图标显示
             iconElement.style.display = 'block';
             previewPlaceholder.style.display = 'none';
             showToast(`预览图刷新失败，已恢复图标显示`, 'warning');
-        };
-        
-        // 设置图片源，强制重新加载
-        newPreviewImg.src = previewUrl;
+        }
         
     } catch (error) {
         console.error(`${PLUGIN_NAME}: Error refreshing preview for ${path}:`, error);
@@ -0,0 +1,268 @@
+// js/workflow_preview.js
+// 预览图调度器 - 基于IntersectionObserver的优先级并发加载
+
+import {
+    PLUGIN_NAME,
+    managerState,
+    loadWorkflowPreviews
+} from './workflow_state.js';
+
+// 加载优先级：可见 > 附近 > 远处
+const PREVIEW_PRIORITY = {
+    VISIBLE: 0,
+    NEAR: 1,
+    FAR: 2
+};
+
+// 同时进行的预览图请求上限
+const MAX_CONCURRENT_PREVIEWS = 4;
+// 单个批量请求包含的预览图数量上限（按优先级）
+// 可见和附近的批次较小，卡片滚出附近区域时才能及时取消对应请求
+const PREVIEW_BATCH_SIZES = [6, 12, 24];
+// "附近"区域相对滚动容器的扩展范围
+const NEAR_ROOT_MARGIN = '200% 0px';
+
+// 将预览图显示到文件项中
+function applyPreviewToItem(item, previewImg) {
+    const iconElement = item.querySelector('.file-icon');
+    const previewPlaceholder = item.querySelector('.preview-placeholder');
+
+    if (!iconElement || !previewPlaceholder) return;
+
+    if (previewImg) {
+        // 隐藏图标，显示预览图
+        iconElement.style.display = 'none';
+        previewPlaceholder.style.display = 'block';
+        previewPlaceholder.innerHTML = '';
+        previewPlaceholder.appendChild(previewImg);
+
+        // 添加预览图样式
+        previewImg.style.cssText = `
+            width: 100%;
+            height: 100%;
+            object-fit: contain;
+            border-radius: 4px;
+            background: var(--comfy-input-bg, #2d2d2d);
+        `;
+    } else {
+        // 没有预览图，保持图标显示
+        iconElement.style.display = 'block';
+        previewPlaceholder.style.display = 'none';
+    }
+}
+
+class PreviewScheduler {
+    constructor({
+        concurrency = MAX_CONCURRENT_PREVIEWS,
+        batchSizes = PREVIEW_BATCH_SIZES,
+        nearMargin = NEAR_ROOT_MARGIN
+    } = {}) {
+        this.concurrency = concurrency;
+        this.batchSizes = batchSizes;
+        this.nearMargin = nearMargin;
+        // 每个优先级一个等待队列，按插入顺序出队
+        this.queues = [new Set(), new Set(), new Set()];
+        // 正在进行的批量请求：{ controller, priority, items }
+        this.tasks = new Set();
+        // 正在加载的文件项 -> 所属请求
+        this.inFlight = new Map();
+        this.visibleItems = new Set();
+        this.nearItems = new Set();
+        this.visibleObserver = null;
+        this.nearObserver = null;
+    }
+
+    // 开始调度一组文件项的预览图加载
+    observe(items, root = null) {
+        this.reset();
+
+        if (typeof IntersectionObserver === 'undefined') {
+            // 不支持IntersectionObserver时按顺序加载
+            items.forEach(item => this.queues[PREVIEW_PRIORITY.FAR].add(item));
+            this._pump();
+            return;
+        }
+
+        this.visibleObserver = new IntersectionObserver(
+            entries => this._handleIntersections(entries, this.visibleItems),
+            { root }
+        );
+        this.nearObserver = new IntersectionObserver(
+            entries => this._handleIntersections(entries, this.nearItems),
+            { root, rootMargin: this.nearMargin }
+        );
+
+        let observedCount = 0;
+        items.forEach(item => {
+            const path = item.dataset.path;
+            this.queues[PREVIEW_PRIORITY.FAR].add(item);
+
+            if (managerState.imageCache.has(path)) {
+                // 已缓存的预览图先直接显示，再以最低优先级向服务端校验版本
+                applyPreviewToItem(item, managerState.imageCache.get(path));
+                return;
+            }
+
+            this.visibleObserver.observe(item);
+            this.nearObserver.observe(item);
+            observedCount++;
+        });
+
+        // 有观察项时，首次调度在观察器的初始回调中进行，确保可见项优先
+        if (observedCount === 0) {
+            this._pump();
+        }
+    }
+
+    // 取消所有请求并停止观察
+    reset() {
+        this.tasks.forEach(task => task.controller.abort());
+        this.tasks.clear();
+        this.inFlight.clear();
+        this.queues.forEach(queue => queue.clear());
+        this.visibleItems.clear();
+        this.nearItems.clear();
+
+        if (this.visibleObserver) {
+            this.visibleObserver.disconnect();
+            this.visibleObserver = null;
+        }
+        if (this.nearObserver) {
+            this.nearObserver.disconnect();
+            this.nearObserver = null;
+        }
+    }
+
+    _handleIntersections(entries, itemSet) {
+        entries.forEach(entry => {
+            if (entry.isIntersecting) {
+                itemSet.add(entry.target);
+            } else {
+                itemSet.delete(entry.target);
+            }
+            this._reprioritize(entry.target);
+        });
+        this._pump();
+    }
+
+    _priorityOf(item) {
+        if (this.visibleItems.has(item)) return PREVIEW_PRIORITY.VISIBLE;
+        if (this.nearItems.has(item)) return PREVIEW_PRIORITY.NEAR;
+        return PREVIEW_PRIORITY.FAR;
+    }
+
+    _reprioritize(item) {
+        const priority = this._priorityOf(item);
+        const task = this.inFlight.get(item);
+
+        if (task) {
+            // 请求中的文件项全部滚出附近区域时，取消请求并降级排队
+            if (task.priority !== PREVIEW_PRIORITY.FAR &&
+                task.items.every(taskItem => this._priorityOf(taskItem) === PREVIEW_PRIORITY.FAR)) {
+                this._cancelTask(task);
+            }
+            return;
+        }
+
+        for (let i = 0; i < this.queues.length; i++) {
+            if (this.queues[i].delete(item)) {
+                this.queues[priority].add(item);
+                return;
+            }
+        }
+    }
+
+    _cancelTask(task) {
+        task.controller.abort();
+        this.tasks.delete(task);
+        task.items.forEach(item => {
+            this.inFlight.delete(item);
+            this.queues[this._priorityOf(item)].add(item);
+        });
+    }
+
+    // 从最高优先级的非空队列中取出一批文件项
+    _dequeueBatch() {
+        for (let i = 0; i < this.queues.length; i++) {
+            const queue = this.queues[i];
+            if (queue.size === 0) continue;
+
+            const items = [];
+            for (const item of queue) {
+                items.push(item);
+                if (items.length >= this.batchSizes[i]) break;
+            }
+            items.forEach(item => queue.delete(item));
+            return { items, priority: i };
+        }
+        return null;
+    }
+
+    _hasUrgentWork() {
+        return this.queues[PREVIEW_PRIORITY.VISIBLE].size > 0 ||
+            this.queues[PREVIEW_PRIORITY.NEAR].size > 0;
+    }
+
+    // 有可见或附近项等待时，让出远处项占用的请求名额
+    _preemptFarTasks() {
+        for (const task of this.tasks) {
+            if (this.tasks.size < this.concurrency || !this._hasUrgentWork()) break;
+            if (task.priority === PREVIEW_PRIORITY.FAR) {
+                this._cancelTask(task);
+            }
+        }
+    }
+
+    _pump() {
+        this._preemptFarTasks();
+
+        while (this.tasks.size < this.concurrency) {
+            const next = this._dequeueBatch();
+            if (!next) break;
+            this._start(next.items, next.priority);
+        }
+    }
+
+    _start(items, priority) {
+        const controller = new AbortController();
+        const task = { controller, priority, items };
+        this.tasks.add(task);
+        items.forEach(item => this.inFlight.set(item, task));
+
+        const paths = items.map(item => item.dataset.path);
+
+        loadWorkflowPreviews(paths, { signal: controller.signal }).then(results => {
+            // 请求已被取消或调度器已重置
+            if (!this.tasks.has(task)) return;
+            this.tasks.delete(task);
+
+            items.forEach(item => {
+                this.inFlight.delete(item);
+                if (this.visibleObserver) this.visibleObserver.unobserve(item);
+                if (this.nearObserver) this.nearObserver.unobserve(item);
+                this.visibleItems.delete(item);
+                this.nearItems.delete(item);
+
+                const path = item.dataset.path;
+                if (!results.has(path)) return;
+
+                try {
+                    applyPreviewToItem(item, results.get(path));
+                } catch (error) {
+                    console.error(`${PLUGIN_NAME}: Error showing preview for ${path}:`, error);
+                }
+            });
+            this._pump();
+        });
+    }
+}
+
+// 全局预览图调度器
+const previewScheduler = new PreviewScheduler();
+
+export {
+    PREVIEW_PRIORITY,
+    PreviewScheduler,
+    previewScheduler,
+    applyPreviewToItem
+};
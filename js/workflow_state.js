@@ -1,9 +1,119 @@
 // js/workflow_state.js
 // 状态管理和工具函数
 
+// 通过ComfyUI的api发送请求，多用户模式下会自动带上当前用户
+import { api } from "../../../scripts/api.js";
+
 const PLUGIN_NAME = "WorkflowManager";
 // 自定义工作流文件图标路径
 const WORKFLOW_FILE_ICON_PATH = "extensions/ComfyUI-WorkflowManager/assets/workflow-file-icon.svg";
+// 预览图缓存上限（按解码后的像素字节数计算）
+const PREVIEW_CACHE_MAX_BYTES = 64 * 1024 * 1024;
+// 单张预览图加载超时（毫秒）
+const PREVIEW_LOAD_TIMEOUT = 5000;
+// 批量预览图请求超时（毫秒）
+const PREVIEW_BATCH_TIMEOUT = 15000;
+// 网格视图中预览图的显示尺寸（CSS像素）
+const PREVIEW_DISPLAY_SIZE = 120;
+
+// 按屏幕像素密度计算需要的预览图尺寸，服务端据此选择缩略图
+function getPreviewRequestSize() {
+    return Math.ceil(PREVIEW_DISPLAY_SIZE * (window.devicePixelRatio || 1));
+}
+
+// 估算图片解码后占用的内存字节数
+function estimateImageBytes(img) {
+    return (img.naturalWidth || 0) * (img.naturalHeight || 0) * 4;
+}
+
+// 释放图片占用的对象URL
+function releaseImage(img) {
+    if (img && typeof img.src === 'string' && img.src.startsWith('blob:')) {
+        URL.revokeObjectURL(img.src);
+    }
+}
+
+// 按字节数限制的LRU图片缓存，接口与Map保持一致
+class PreviewImageCache {
+    constructor(maxBytes = PREVIEW_CACHE_MAX_BYTES) {
+        this.maxBytes = maxBytes;
+        this.totalBytes = 0;
+        this.entries = new Map();
+    }
+    
+    get size() {
+        return this.entries.size;
+    }
+    
+    has(key) {
+        return this.entries.has(key);
+    }
+    
+    get(key) {
+        const entry = this.entries.get(key);
+        if (!entry) return undefined;
+        
+        // 移动到最近使用的位置
+        this.entries.delete(key);
+        this.entries.set(key, entry);
+        return entry.img;
+    }
+    
+    // 获取缓存图片对应的服务端版本号
+    getVersion(key) {
+        const entry = this.entries.get(key);
+        return entry ? entry.version : null;
+    }
+    
+    set(key, img, version = null) {
+        const bytes = estimateImageBytes(img);
+        const existing = this.entries.get(key);
+        if (existing) {
+            this.entries.delete(key);
+            this.totalBytes -= existing.bytes;
+            if (existing.img !== img) {
+                releaseImage(existing.img);
+            }
+        }
+        
+        // 超过整个缓存容量的图片不缓存
+        if (bytes > this.maxBytes) {
+            return this;
+        }
+        
+        this.entries.set(key, { img, bytes, version });
+        this.totalBytes += bytes;
+        
+        // 淘汰最久未使用的图片
+        for (const [oldKey, entry] of this.entries) {
+            if (this.totalBytes <= this.maxBytes) break;
+            this.entries.delete(oldKey);
+            this.totalBytes -= entry.bytes;
+            releaseImage(entry.img);
+        }
+        return this;
+    }
+    
+    delete(key) {
+        const entry = this.entries.get(key);
+        if (!entry) return false;
+        
+        this.entries.delete(key);
+        this.totalBytes -= entry.bytes;
+        releaseImage(entry.img);
+        return true;
+    }
+    
+    keys() {
+        return this.entries.keys();
+    }
+    
+    clear() {
+        this.entries.forEach(entry => releaseImage(entry.img));
+        this.entries.clear();
+        this.totalBytes = 0;
+    }
+}
 
 // 管理器状态
 const managerState = {
@@ -16,7 +126,7 @@ const managerState = {
     sortOrder: 'asc', // 'asc' or 'desc'
     expandedFolders: new Set(), // 已展开的文件夹路径
     previewMode: false, // 预览图模式开关
-    imageCache: new Map(), // 图片缓存
+    imageCache: new PreviewImageCache(), // 图片缓存（LRU）
     lastSelectedItem: null // 用于Shift多选的最后选择项
 };
 
@@ -298,123 +408,187 @@ function showLoading(show) {
     loadingOverlay.style.display = show ? 'flex' : 'none';
 }
 
+// 创建带超时的取消控制器，外部取消信号会同步到该控制器
+function createPreviewAbortController(signal, timeout, label) {
+    const controller = new AbortController();
+    const abort = () => controller.abort();
+    if (signal) {
+        if (signal.aborted) {
+            controller.abort();
+        } else {
+            signal.addEventListener('abort', abort, { once: true });
+        }
+    }
+    const timeoutId = setTimeout(() => {
+        console.warn(`${PLUGIN_NAME}: Preview load timeout for: ${label}`);
+        abort();
+    }, timeout);
+    
+    const cleanup = () => {
+        clearTimeout(timeoutId);
+        if (signal) {
+            signal.removeEventListener('abort', abort);
+        }
+    };
+    return { controller, cleanup };
+}
+
+// 将图片数据解码为Image对象，失败时返回null
+async function decodePreviewBlob(blob) {
+    const objectUrl = URL.createObjectURL(blob);
+    const img = new Image();
+    img.crossOrigin = 'anonymous';
+    img.src = objectUrl;
+    
+    try {
+        await img.decode();
+        return img;
+    } catch (error) {
+        URL.revokeObjectURL(objectUrl);
+        return null;
+    }
+}
+
 // 预览图相关函数
-async function loadWorkflowPreview(path) {
+async function loadWorkflowPreview(path, { signal } = {}) {
     // 检查缓存
     if (managerState.imageCache.has(path)) {
         return managerState.imageCache.get(path);
     }
     
+    const { controller, cleanup } = createPreviewAbortController(signal, PREVIEW_LOAD_TIMEOUT, path);
+    
     try {
-        // 首先测试API是否正常工作
-        const apiWorking = await testPreviewAPI(path);
-        if (!apiWorking) {
-            // API测试失败（通常是404，表示没有预览图），静默返回null
+        // 构建预览图URL - 使用时间戳避免缓存
+        const timestamp = Date.now();
+        const size = getPreviewRequestSize();
+        const previewUrl = `/workflow-manager/preview?path=${encodeURIComponent(path)}&size=${size}&t=${timestamp}`;
+        
+        const response = await api.fetchApi(previewUrl, { signal: controller.signal });
+        
+        if (!response.ok) {
+            // 404是正常情况，表示该工作流文件没有预览图
+            if (response.status !== 404) {
+                console.error(`${PLUGIN_NAME}: ❌ API returned error status:`, response.status, response.statusText);
+            }
             return null;
         }
         
-        // 构建预览图URL - 使用时间戳避免缓存
-        const timestamp = Date.now();
-        const previewUrl = `/workflow-manager/preview?path=${encodeURIComponent(path)}&t=${timestamp}`;
+        const contentType = response.headers.get('content-type');
+        if (!contentType || !contentType.startsWith('image/')) {
+            console.error(`${PLUGIN_NAME}: ❌ API returned wrong content type:`, contentType);
+            return null;
+        }
         
-        // 创建图片对象
-        const img = new Image();
+        const img = await decodePreviewBlob(await response.blob());
+        if (!img) {
+            console.error(`${PLUGIN_NAME}: Preview decode failed for: ${path}`);
+            return null;
+        }
         
-        return new Promise((resolve) => {
-            img.onload = () => {
-                // 缓存成功加载的图片
-                managerState.imageCache.set(path, img);
-                resolve(img);
-            };
-            
-            img.onerror = (error) => {
-                // 加载失败时返回null，降级到默认图标
-                console.error(`${PLUGIN_NAME}: Preview load failed for: ${path}`);
-                console.error(`${PLUGIN_NAME}: Error details:`, error);
-                console.error(`${PLUGIN_NAME}: Image src: ${img.src}`);
-                console.error(`${PLUGIN_NAME}: Image naturalWidth: ${img.naturalWidth}, naturalHeight: ${img.naturalHeight}`);
-                resolve(null);
-            };
-            
-            // 设置跨域属性
-            img.crossOrigin = 'anonymous';
-            
-            // 设置图片源
-            img.src = previewUrl;
-            
-            // 设置超时处理
-            setTimeout(() => {
-                if (!img.complete) {
-                    console.warn(`${PLUGIN_NAME}: Preview load timeout for: ${path}`);
-                    resolve(null);
-                }
-            }, 5000); // 5秒超时
-        });
+        if (controller.signal.aborted) {
+            URL.revokeObjectURL(img.src);
+            return null;
+        }
+        
+        // 缓存成功加载的图片
+        managerState.imageCache.set(path, img, response.headers.get('X-Preview-Version'));
+        return img;
     } catch (error) {
-        console.error(`${PLUGIN_NAME}: Error loading preview for ${path}:`, error);
+        // 被取消的请求不视为错误
+        if (error.name !== 'AbortError' && !controller.signal.aborted) {
+            console.error(`${PLUGIN_NAME}: Error loading preview for ${path}:`, error);
+        }
         return null;
+    } finally {
+        cleanup();
     }
 }
 
-// 懒加载预览图（只加载可视区域内的图片）
-function loadVisiblePreviews() {
-    if (!managerState.previewMode) return;
+// 批量加载预览图，返回 Map(路径 -> Image或null)
+// 已缓存的图片会带上版本号，服务端版本未变时直接复用缓存
+async function loadWorkflowPreviews(paths, { signal, retryEvicted = true } = {}) {
+    const results = new Map();
+    if (paths.length === 0) return results;
     
-    const workflowItems = document.querySelectorAll('.file-item[data-type="workflow"]');
-    const viewportHeight = window.innerHeight;
-    
-    workflowItems.forEach(item => {
-        const rect = item.getBoundingClientRect();
-        const isVisible = rect.top < viewportHeight && rect.bottom > 0;
-        
-        if (isVisible) {
-            const path = item.dataset.path;
-            const previewPlaceholder = item.querySelector('.preview-placeholder');
-            const iconElement = item.querySelector('.file-icon');
-            
-            if (previewPlaceholder && iconElement && !previewPlaceholder.hasChildNodes()) {
-                loadWorkflowPreview(path).then(previewImg => {
-                    if (previewImg) {
-                        iconElement.style.display = 'none';
-                        previewPlaceholder.style.display = 'block';
-                        previewPlaceholder.innerHTML = '';
-                        previewPlaceholder.appendChild(previewImg);
-                        
-                        // 添加预览图样式
-                        previewImg.style.cssText = `
-                            width: 100%;
-                            height: 100%;
-                            object-fit: contain;
-                            border-radius: 4px;
-                            background: var(--comfy-input-bg, #2d2d2d);
-                        `;
-                    }
-                });
-            }
+    const known = {};
+    paths.forEach(path => {
+        const version = managerState.imageCache.getVersion(path);
+        if (version) {
+            known[path] = version;
         }
     });
-}
-
-// 预加载附近的预览图
-function preloadNearbyPreviews() {
-    if (!managerState.previewMode) return;
     
-    const workflowItems = document.querySelectorAll('.file-item[data-type="workflow"]');
-    const viewportHeight = window.innerHeight;
-    const preloadDistance = viewportHeight * 2; // 预加载2倍视口高度的内容
+    const { controller, cleanup } = createPreviewAbortController(
+        signal, PREVIEW_BATCH_TIMEOUT, `${paths.length} previews`
+    );
     
-    workflowItems.forEach(item => {
-        const rect = item.getBoundingClientRect();
-        const isNearby = rect.top < preloadDistance && rect.bottom > -preloadDistance;
+    try {
+        const response = await api.fetchApi('/workflow-manager/preview-batch', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ paths, known, size: getPreviewRequestSize() }),
+            signal: controller.signal
+        });
+        
+        if (!response.ok) {
+            console.error(`${PLUGIN_NAME}: ❌ Preview batch returned error status:`, response.status, response.statusText);
+            return results;
+        }
+        
+        const formData = await response.formData();
+        const manifest = JSON.parse(formData.get('manifest'));
+        // 请求期间已被LRU淘汰、服务端却返回未修改的预览图
+        const evictedPaths = [];
         
-        if (isNearby) {
-            const path = item.dataset.path;
-            if (!managerState.imageCache.has(path)) {
-                // 预加载但不显示
-                loadWorkflowPreview(path);
+        await Promise.all(manifest.items.map(async entry => {
+            const { path, status, version, field } = entry;
+            
+            if (status === 'not_modified') {
+                if (managerState.imageCache.has(path)) {
+                    results.set(path, managerState.imageCache.get(path));
+                } else {
+                    evictedPaths.push(path);
+                }
+                return;
+            }
+            
+            const blob = status === 'ok' ? formData.get(field) : null;
+            if (!blob) {
+                // 预览图已被删除，清除过期缓存
+                managerState.imageCache.delete(path);
+                results.set(path, null);
+                return;
+            }
+            
+            const img = await decodePreviewBlob(blob);
+            if (img && controller.signal.aborted) {
+                URL.revokeObjectURL(img.src);
+                return;
+            }
+            if (img) {
+                managerState.imageCache.set(path, img, version);
             }
+            results.set(path, img);
+        }));
+        
+        // 预览图并未删除，不带版本号重新请求一次，而不是清除已显示的预览图
+        if (evictedPaths.length > 0 && retryEvicted && !controller.signal.aborted) {
+            const reloaded = await loadWorkflowPreviews(evictedPaths, { signal, retryEvicted: false });
+            reloaded.forEach((img, path) => results.set(path, img));
         }
-    });
+    } catch (error) {
+        // 被取消的请求不视为错误
+        if (error.name !== 'AbortError' && !controller.signal.aborted) {
+            console.error(`${PLUGIN_NAME}: Error loading preview batch:`, error);
+        }
+    } finally {
+        cleanup();
+    }
+    
+    return results;
 }
 
 // 清除图片缓存
@@ -434,7 +608,7 @@ async function testPreviewAPI(path) {
         const timestamp = Date.now();
         const previewUrl = `/workflow-manager/preview?path=${encodeURIComponent(path)}&t=${timestamp}`;
         
-        const response = await fetch(previewUrl);
+        const response = await api.fetchApi(previewUrl);
         
         if (response.ok) {
             const contentType = response.headers.get('content-type');
@@ -479,9 +653,9 @@ export {
     updateToolbar,
     showToast,
     showLoading,
+    PreviewImageCache,
     loadWorkflowPreview,
-    loadVisiblePreviews,
-    preloadNearbyPreviews,
+    loadWorkflowPreviews,
     clearImageCache,
     getPreviewPath,
     testPreviewAPI,
@@ -236,25 +236,6 @@ function bindManagerEvents(container) {
     // 面包屑导航事件
     container.querySelector('#breadcrumb').addEventListener('click', handleBreadcrumbClick);
     
-    // 添加滚动事件监听，实现预览图懒加载
-    const managerContent = container.querySelector('#managerContent');
-    if (managerContent) {
-        let scrollTimeout;
-        managerContent.addEventListener('scroll', () => {
-            // 防抖处理
-            clearTimeout(scrollTimeout);
-            scrollTimeout = setTimeout(() => {
-                if (managerState.previewMode) {
-                    // 动态导入懒加载函数
-                    import('./workflow_state.js').then(({ loadVisiblePreviews, preloadNearbyPreviews }) => {
-                        loadVisiblePreviews();
-                        preloadNearbyPreviews();
-                    });
-                }
-            }, 100);
-        });
-    }
-
     // 空文件夹区域右键菜单事件
     const emptyState = container.querySelector('#emptyState');
     if (emptyState) {
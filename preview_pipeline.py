@@ -0,0 +1,89 @@
+# preview_pipeline.py
+"""
+预览图处理流水线 - 校验上传图片的真实格式，转码为WebP并生成缩略图
+
+本模块只依赖Pillow，在线程池中运行，不修改Pillow的全局设置。
+"""
+
+import os
+import tempfile
+from PIL import Image, ImageOps
+
+# 允许上传的真实图片格式（Pillow识别出的格式名）
+ALLOWED_PREVIEW_FORMATS = {'PNG', 'JPEG', 'WEBP', 'GIF', 'BMP'}
+# 解码前允许的最大像素数，防止解压炸弹（不修改 Image.MAX_IMAGE_PIXELS，以免影响ComfyUI自身的图片加载）
+MAX_PREVIEW_PIXELS = 64 * 1024 * 1024
+
+def thumbnail_suffix(size):
+    """缩略图文件后缀，例如 .thumb-256.webp"""
+    return f".thumb-{size}.webp"
+
+def _prepare_image(img):
+    """按EXIF方向旋转并转换为WebP支持的颜色模式，同时丢弃所有元数据"""
+    img = ImageOps.exif_transpose(img)
+    has_alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+    img = img.convert('RGBA' if has_alpha else 'RGB')
+    # 丢弃EXIF、ICC等元数据，保存时不会再写出
+    img.info = {}
+    return img
+
+def _save_webp(img, directory, quality):
+    """在目标目录中写入临时WebP文件，返回临时文件路径"""
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.preview-', suffix='.webp.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            img.save(f, format='WEBP', quality=quality, method=4)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return temp_path
+
+def transcode_preview(source_path, output_dir, max_size, quality, thumbnail_sizes):
+    """校验并转码上传的预览图
+
+    返回 {"preview": 临时文件路径, "thumbnails": {尺寸: 临时文件路径}, "format": 原始格式}，
+    临时文件与最终文件位于同一目录，由调用方原子替换到位。
+    图片格式不受支持或无法解码时抛出 ValueError。
+    """
+    try:
+        with Image.open(source_path) as img:
+            source_format = img.format
+            if source_format not in ALLOWED_PREVIEW_FORMATS:
+                raise ValueError(f"不支持的图片格式: {source_format}")
+            # Image.open 只读取文件头，在解码前检查尺寸
+            if img.width * img.height > MAX_PREVIEW_PIXELS:
+                raise ValueError(f"图片尺寸过大: {img.width}x{img.height}")
+            # 动图只取第一帧
+            img.seek(0)
+            img.load()
+            prepared = _prepare_image(img)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"无法识别的图片文件: {e}")
+
+    outputs = {"preview": None, "thumbnails": {}, "format": source_format}
+    try:
+        preview = prepared.copy()
+        preview.thumbnail((max_size, max_size), Image.LANCZOS)
+        outputs["preview"] = _save_webp(preview, output_dir, quality)
+
+        # 缩略图从大到小依次缩放，复用上一级结果
+        thumbnail = preview
+        for size in sorted(set(thumbnail_sizes), reverse=True):
+            if size >= max(preview.size):
+                # 原图已经不大于该尺寸，不单独生成缩略图
+                continue
+            thumbnail = thumbnail.copy()
+            thumbnail.thumbnail((size, size), Image.LANCZOS)
+            outputs["thumbnails"][size] = _save_webp(thumbnail, output_dir, quality)
+    except Exception:
+        discard_outputs(outputs)
+        raise
+
+    return outputs
+
+def discard_outputs(outputs):
+    """删除未使用的临时输出文件"""
+    paths = [outputs.get("preview")] + list(outputs.get("thumbnails", {}).values())
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,331 @@
+# workflow_revisions.py
+"""
+工作流修订历史 - 以压缩的增量保存工作流的每次修改
+
+每个工作流对应一个只追加的pack文件（与工作流目录结构一一对应，例如
+sub/a.json -> sub/a.json.pack）。每条记录由头信息和zlib压缩的内容组成，
+内容为完整快照或相对上一版本的增量，每隔固定数量的版本保存一次完整快照，
+恢复时最多只需应用 SNAPSHOT_INTERVAL 个增量。
+
+本模块只依赖标准库，不导入ComfyUI相关模块。
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import struct
+import difflib
+import hashlib
+import tempfile
+import threading
+
+PACK_SUFFIX = '.pack'
+# 每隔多少个版本保存一次完整快照
+SNAPSHOT_INTERVAL = 16
+# 记录头：头信息长度、内容长度
+RECORD_HEADER = struct.Struct('>II')
+
+# 增量操作：从上一版本复制片段区间 / 插入新片段
+DELTA_COPY = 0
+DELTA_INSERT = 1
+# 超过该片段数的版本直接保存完整快照，避免在锁内进行耗时的比较
+MAX_DELTA_LINES = 50000
+
+# 在每个换行或逗号之后断开，压缩格式（单行）的JSON也能按片段计算增量
+SPLIT_PATTERN = re.compile(r'[^,\n]*(?:,\n?|\n)|[^,\n]+')
+
+def split_workflow(content):
+    """校验工作流内容并切分为文本片段，内容不是合法JSON时抛出 ValueError
+
+    保存的是原始文本，片段拼接后与保存时的文档完全一致，恢复时不会改变键的顺序和格式。
+    """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8')
+    json.loads(content)
+    return SPLIT_PATTERN.findall(content)
+
+def format_workflow_lines(lines):
+    """将版本内容格式化为便于比较的JSON文本行（保持键的原有顺序）"""
+    workflow = json.loads(''.join(lines))
+    return json.dumps(workflow, indent=1, ensure_ascii=False).splitlines(keepends=True)
+
+def make_delta(base_lines, lines):
+    """生成从 base_lines 到 lines 的增量
+
+    使用默认的 autojunk：工作流中大量重复的行（如 "},"）不参与匹配，
+    否则比较耗时随行数平方增长。
+    """
+    delta = []
+    matcher = difflib.SequenceMatcher(None, base_lines, lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append([DELTA_COPY, i1, i2])
+        elif tag in ('replace', 'insert'):
+            delta.append([DELTA_INSERT, lines[j1:j2]])
+    return delta
+
+def apply_delta(base_lines, delta):
+    """将增量应用到 base_lines 上"""
+    lines = []
+    for op in delta:
+        if op[0] == DELTA_COPY:
+            lines.extend(base_lines[op[1]:op[2]])
+        else:
+            lines.extend(op[1])
+    return lines
+
+def diff_lines(relative_path, from_lines, to_lines, from_label, to_label):
+    """生成两个版本之间的统一diff文本（按格式化后的JSON逐行比较）"""
+    return ''.join(difflib.unified_diff(
+        format_workflow_lines(from_lines), format_workflow_lines(to_lines),
+        fromfile=f"{relative_path}@{from_label}",
+        tofile=f"{relative_path}@{to_label}"
+    ))
+
+def _hash_lines(lines):
+    return hashlib.sha256(''.join(lines).encode('utf-8')).hexdigest()
+
+class RevisionStore:
+    """一个工作流根目录的修订历史存储"""
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.lock = threading.Lock()
+
+    # ---- pack文件读写 ----
+
+    def pack_path(self, relative_path):
+        """工作流相对路径对应的pack文件路径"""
+        pack_path = os.path.abspath(os.path.join(self.directory, relative_path + PACK_SUFFIX))
+        if not pack_path.startswith(self.directory + os.sep):
+            raise ValueError(f"无效的路径: {relative_path}")
+        return pack_path
+
+    def _read_records(self, pack_path):
+        """读取pack文件中的所有记录，返回 [(头信息, 压缩内容)]"""
+        return self._read_pack(pack_path)[0]
+
+    def _read_pack(self, pack_path):
+        """读取pack文件，返回(记录列表, 完整记录占用的字节数)"""
+        if not os.path.exists(pack_path):
+            return [], 0
+
+        with open(pack_path, 'rb') as f:
+            data = f.read()
+
+        records = []
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            header_len, payload_len = RECORD_HEADER.unpack_from(data, offset)
+            header_start = offset + RECORD_HEADER.size
+            end = header_start + header_len + payload_len
+            if end > len(data):
+                # 末尾记录写入不完整（例如进程被中断），忽略
+                break
+            header = json.loads(data[header_start:header_start + header_len].decode('utf-8'))
+            records.append((header, data[header_start + header_len:end]))
+            offset = end
+        return records, offset
+
+    @staticmethod
+    def _encode_record(header, payload):
+        header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        return RECORD_HEADER.pack(len(header_bytes), len(payload)) + header_bytes + payload
+
+    def _build_record(self, base_lines, since_snapshot, lines, header):
+        """决定保存快照还是增量，返回(编码后的记录, 类型)
+
+        base_lines 为上一版本的内容（没有上一版本时为None），
+        since_snapshot 为上一个完整快照之后已有的增量数量。
+        """
+        full_payload = zlib.compress(''.join(lines).encode('utf-8'), 9)
+
+        if (base_lines is not None and since_snapshot + 1 < SNAPSHOT_INTERVAL
+                and max(len(base_lines), len(lines)) <= MAX_DELTA_LINES):
+            delta = json.dumps(make_delta(base_lines, lines), ensure_ascii=False)
+            delta_payload = zlib.compress(delta.encode('utf-8'), 9)
+            if len(delta_payload) < len(full_payload):
+                return self._encode_record({**header, 'kind': 'delta'}, delta_payload), 'delta'
+
+        return self._encode_record({**header, 'kind': 'full'}, full_payload), 'full'
+
+    @staticmethod
+    def _count_since_snapshot(records):
+        since_snapshot = 0
+        for header, _ in reversed(records):
+            if header['kind'] == 'full':
+                break
+            since_snapshot += 1
+        return since_snapshot
+
+    def _materialize(self, records, index):
+        """还原第 index 条记录对应的内容片段"""
+        start = index
+        while records[start][0]['kind'] != 'full':
+            start -= 1
+
+        lines = None
+        for header, payload in records[start:index + 1]:
+            data = zlib.decompress(payload).decode('utf-8')
+            if header['kind'] == 'full':
+                lines = SPLIT_PATTERN.findall(data)
+            else:
+                lines = apply_delta(lines, json.loads(data))
+        return lines
+
+    def _write_pack(self, pack_path, encoded_records):
+        """原子地重写整个pack文件"""
+        os.makedirs(os.path.dirname(pack_path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(pack_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for record in encoded_records:
+                    f.write(record)
+            os.replace(temp_path, pack_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @staticmethod
+    def _find_index(records, rev):
+        for index, (header, _) in enumerate(records):
+            if header['rev'] == rev:
+                return index
+        raise KeyError(f"修订版本不存在: {rev}")
+
+    # ---- 对外接口 ----
+
+    def record(self, relative_path, content, op, **extra):
+        """记录一个新版本，内容与最新版本相同时跳过（改名等操作除外），返回版本号或None"""
+        lines = split_workflow(content)
+        content_hash = _hash_lines(lines)
+
+        with self.lock:
+            pack_path = self.pack_path(relative_path)
+            records, valid_size = self._read_pack(pack_path)
+
+            if records and records[-1][0]['hash'] == content_hash and op in ('save', 'upload'):
+                return None
+
+            rev = records[-1][0]['rev'] + 1 if records else 1
+            header = {
+                'rev': rev,
+                'time': time.time(),
+                'op': op,
+                'path': relative_path,
+                'hash': content_hash,
+                'size': sum(len(line.encode('utf-8')) for line in lines),
+                **extra
+            }
+            base_lines = self._materialize(records, len(records) - 1) if records else None
+            record, _ = self._build_record(base_lines, self._count_since_snapshot(records), lines, header)
+
+            os.makedirs(os.path.dirname(pack_path), exist_ok=True)
+            with open(pack_path, 'ab') as f:
+                # 丢弃末尾不完整的记录后再追加
+                if f.tell() != valid_size:
+                    f.truncate(valid_size)
+                f.write(record)
+            return rev
+
+    def list_revisions(self, relative_path):
+        """列出工作流的所有版本信息（不含内容）"""
+        with self.lock:
+            records = self._read_records(self.pack_path(relative_path))
+        return [
+            {key: value for key, value in header.items() if key != 'hash'}
+            for header, _ in records
+        ]
+
+    def get_lines(self, relative_path, rev):
+        """获取指定版本的内容片段，拼接后即为保存时的原始文档"""
+        with self.lock:
+            records = self._read_records(self.pack_path(relative_path))
+        return self._materialize(records, self._find_index(records, rev))
+
+    def move(self, old_relative_path, new_relative_path, is_directory=False):
+        """工作流或文件夹改名/移动时同步移动历史"""
+        with self.lock:
+            if is_directory:
+                old_path = os.path.abspath(os.path.join(self.directory, old_relative_path))
+                new_path = os.path.abspath(os.path.join(self.directory, new_relative_path))
+                if not old_path.startswith(self.directory + os.sep) or not new_path.startswith(self.directory + os.sep):
+                    raise ValueError("无效的路径")
+            else:
+                old_path = self.pack_path(old_relative_path)
+                new_path = self.pack_path(new_relative_path)
+
+            if not os.path.exists(old_path) or os.path.exists(new_path):
+                return False
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            os.replace(old_path, new_path)
+            return True
+
+    def compact(self, pack_path, keep_from_rev):
+        """丢弃 keep_from_rev 之前的版本，并重新编码剩余版本（第一个保留版本改为完整快照）"""
+        records = self._read_records(pack_path)
+        kept = [(header, self._materialize(records, index))
+                for index, (header, _) in enumerate(records) if header['rev'] >= keep_from_rev]
+
+        if not kept:
+            os.remove(pack_path)
+            return
+
+        encoded = []
+        base_lines = None
+        since_snapshot = 0
+        for header, lines in kept:
+            header = {key: value for key, value in header.items() if key != 'kind'}
+            record, kind = self._build_record(base_lines, since_snapshot, lines, header)
+            encoded.append(record)
+            base_lines = lines
+            since_snapshot = 0 if kind == 'full' else since_snapshot + 1
+        self._write_pack(pack_path, encoded)
+
+    def gc(self, max_bytes):
+        """按总大小预算清理历史：从最旧的版本开始丢弃，每个工作流至少保留最新版本
+
+        压缩后每个pack的第一个保留版本会改写为完整快照，体积可能变大，
+        因此重复清理，直到不超过预算或只剩各工作流的最新版本。
+        """
+        with self.lock:
+            packs = []
+            for dirpath, _, filenames in os.walk(self.directory):
+                for filename in filenames:
+                    if filename.endswith(PACK_SUFFIX):
+                        packs.append(os.path.join(dirpath, filename))
+
+            before = sum(os.path.getsize(pack) for pack in packs)
+            after = before
+            dropped = 0
+
+            while after > max_bytes:
+                # 收集可丢弃的版本（每个pack的最新版本除外），按实际编码后的大小计算
+                candidates = []
+                for pack in packs:
+                    records = self._read_records(pack)
+                    for header, payload in records[:-1]:
+                        record_size = len(self._encode_record(header, payload))
+                        candidates.append((header['time'], pack, header['rev'], record_size))
+                if not candidates:
+                    break
+                candidates.sort()
+
+                keep_from = {}
+                excess = after - max_bytes
+                for _, pack, rev, record_size in candidates:
+                    if excess <= 0:
+                        break
+                    keep_from[pack] = rev + 1
+                    excess -= record_size
+                    dropped += 1
+
+                for pack, rev in keep_from.items():
+                    self.compact(pack, rev)
+
+                after = sum(os.path.getsize(pack) for pack in packs)
+
+            return {"before": before, "after": after, "dropped": dropped}